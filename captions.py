@@ -0,0 +1,144 @@
+# captions.py - TTS 대본 → 자막 트랙 (SRT/WebVTT, mp4 소프트 자막)
+import os
+import re
+import subprocess
+
+CAPTION_MAX_CHARS = 18      # 자막 1줄 최대 글자 수 (세로 화면 기준)
+SENTENCE_PAUSE_WEIGHT = 2   # 문장 끝 쉼을 글자 수로 환산한 가중치
+MUX_TIMEOUT_SECONDS = 60    # 자막 스트림 추가 ffmpeg 최대 실행 시간
+
+def caption_paths(video_file):
+    """비디오 파일에 대응하는 (srt, vtt) 경로"""
+    base = os.path.splitext(video_file)[0]
+    return base + '.srt', base + '.vtt'
+
+def split_caption_lines(script, max_chars=CAPTION_MAX_CHARS):
+    """
+    대본을 문장 → 단어 묶음 단위 자막 줄로 분할
+
+    Returns:
+        [(text, weight), ...] - weight는 발화 시간 비례 가중치
+    """
+    segments = []
+
+    for sentence in re.split(r'(?<=[.!?])\s+', script.strip()):
+        words = sentence.split()
+        chunks = []
+        current = ""
+
+        for word in words:
+            candidate = f"{current} {word}".strip()
+            if current and len(candidate) > max_chars:
+                chunks.append(current)
+                current = word
+            else:
+                current = candidate
+        if current:
+            chunks.append(current)
+
+        for idx, chunk in enumerate(chunks):
+            weight = len(chunk.replace(' ', ''))
+            if idx == len(chunks) - 1:
+                weight += SENTENCE_PAUSE_WEIGHT
+            segments.append((chunk, weight))
+
+    return segments
+
+def build_caption_segments(script, duration):
+    """
+    음성 길이를 글자 수 비율로 나눠 자막 타이밍 계산
+
+    Returns:
+        [(start, end, text), ...] (초 단위)
+    """
+    lines = split_caption_lines(script)
+    total_weight = sum(weight for _, weight in lines)
+    if not lines or total_weight <= 0 or duration <= 0:
+        return []
+
+    segments = []
+    elapsed = 0
+    for text, weight in lines:
+        start = duration * elapsed / total_weight
+        elapsed += weight
+        end = duration * elapsed / total_weight
+        segments.append((start, end, text))
+
+    return segments
+
+def _format_timestamp(seconds, separator):
+    millis = int(round(seconds * 1000))
+    hours, millis = divmod(millis, 3600000)
+    minutes, millis = divmod(millis, 60000)
+    secs, millis = divmod(millis, 1000)
+    return f"{hours:02d}:{minutes:02d}:{secs:02d}{separator}{millis:03d}"
+
+def write_srt(segments, output_file):
+    """SRT 자막 저장"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        for idx, (start, end, text) in enumerate(segments, 1):
+            f.write(f"{idx}\n")
+            f.write(f"{_format_timestamp(start, ',')} --> {_format_timestamp(end, ',')}\n")
+            f.write(f"{text}\n\n")
+    return output_file
+
+def write_vtt(segments, output_file):
+    """WebVTT 자막 저장"""
+    with open(output_file, 'w', encoding='utf-8') as f:
+        f.write("WEBVTT\n\n")
+        for start, end, text in segments:
+            f.write(f"{_format_timestamp(start, '.')} --> {_format_timestamp(end, '.')}\n")
+            f.write(f"{text}\n\n")
+    return output_file
+
+def write_captions(script, duration, video_file):
+    """
+    비디오용 SRT/WebVTT 자막 생성
+
+    Returns:
+        (srt_file, vtt_file) 또는 자막 구간이 없으면 None
+    """
+    segments = build_caption_segments(script, duration)
+    if not segments:
+        return None
+
+    srt_file, vtt_file = caption_paths(video_file)
+    write_srt(segments, srt_file)
+    write_vtt(segments, vtt_file)
+    return srt_file, vtt_file
+
+def mux_soft_subtitles(video_file, srt_file, language='kor'):
+    """
+    mp4에 소프트 자막 스트림(mov_text) 추가 (영상/음성 재인코딩 없음)
+
+    Returns:
+        성공 여부
+    """
+    from imageio_ffmpeg import get_ffmpeg_exe
+
+    muxed_file = os.path.splitext(video_file)[0] + '.subs.mp4'
+    command = [
+        get_ffmpeg_exe(), '-y', '-loglevel', 'error',
+        '-i', video_file, '-i', srt_file,
+        '-map', '0', '-map', '1',
+        '-c', 'copy', '-c:s', 'mov_text',
+        '-metadata:s:s:0', f'language={language}',
+        muxed_file
+    ]
+
+    try:
+        result = subprocess.run(command, capture_output=True, text=True, timeout=MUX_TIMEOUT_SECONDS)
+        error = None
+        if result.returncode != 0:
+            error = result.stderr.strip()[:200] or f"ffmpeg 종료 코드 {result.returncode}"
+    except subprocess.TimeoutExpired:
+        error = f"시간 초과 ({MUX_TIMEOUT_SECONDS}초)"
+
+    if error:
+        print(f"   ⚠️ 자막 스트림 추가 실패: {error}")
+        if os.path.exists(muxed_file):
+            os.unlink(muxed_file)
+        return False
+
+    os.replace(muxed_file, video_file)
+    return True
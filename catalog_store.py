@@ -0,0 +1,166 @@
+# catalog_store.py - 제품 카탈로그 저장소 (SQLite, 실행 간 이력 유지)
+import os
+import json
+import sqlite3
+from datetime import datetime, timedelta
+
+CATALOG_DB = os.environ.get('CATALOG_DB', 'catalog.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS products (
+    product_id TEXT PRIMARY KEY,
+    keyword TEXT NOT NULL,
+    name TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    category TEXT,
+    rate REAL,
+    commission INTEGER,
+    rocket INTEGER NOT NULL DEFAULT 0,
+    url TEXT,
+    image_url TEXT,
+    review_count INTEGER,
+    rating REAL,
+    first_seen TEXT NOT NULL,
+    last_seen TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_products_keyword ON products (keyword);
+
+CREATE TABLE IF NOT EXISTS price_history (
+    product_id TEXT NOT NULL,
+    price INTEGER NOT NULL,
+    recorded_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_price_history_product ON price_history (product_id, recorded_at);
+
+-- 쇼츠 렌더링 이력 (파이프라인은 업로드하지 않으므로 렌더링 시점 기준)
+CREATE TABLE IF NOT EXISTS renders (
+    product_id TEXT NOT NULL,
+    keyword TEXT NOT NULL,
+    video_file TEXT NOT NULL,
+    rendered_at TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_renders_product ON renders (product_id, rendered_at);
+CREATE INDEX IF NOT EXISTS idx_renders_date ON renders (rendered_at);
+"""
+
+# products.json 필드 순서 (기존 출력 형태 유지)
+EXPORT_FIELDS = [
+    'keyword', 'name', 'price', 'category', 'rate', 'commission',
+    'rocket', 'url', 'image_url', 'review_count', 'rating'
+]
+
+def _now():
+    return datetime.now().isoformat(timespec='seconds')
+
+def product_key(product):
+    """카탈로그 키 (productId, 없으면 파트너스 링크 또는 제품명)"""
+    return str(product.get('product_id') or product.get('url') or product['name'])
+
+def open_catalog(db_path=CATALOG_DB):
+    """카탈로그 DB 연결 (스키마 없으면 생성)"""
+    conn = sqlite3.connect(db_path)
+    conn.row_factory = sqlite3.Row
+    conn.executescript(SCHEMA)
+    return conn
+
+def upsert_products(conn, products):
+    """이번 실행의 제품을 하나의 트랜잭션으로 일괄 upsert (가격 이력 포함)"""
+    now = _now()
+    rows = [
+        (
+            product_key(product), product['keyword'], product['name'], product.get('price', 0),
+            product.get('category', ''), product.get('rate', 0.0), product.get('commission', 0),
+            int(bool(product.get('rocket', False))), product.get('url', ''),
+            product.get('image_url', ''), product.get('review_count', 0),
+            product.get('rating', 0.0), now, now
+        )
+        for product in products
+    ]
+
+    with conn:
+        conn.executemany("""
+            INSERT INTO products (
+                product_id, keyword, name, price, category, rate, commission, rocket,
+                url, image_url, review_count, rating, first_seen, last_seen
+            ) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            ON CONFLICT (product_id) DO UPDATE SET
+                keyword = excluded.keyword,
+                name = excluded.name,
+                price = excluded.price,
+                category = excluded.category,
+                rate = excluded.rate,
+                commission = excluded.commission,
+                rocket = excluded.rocket,
+                url = excluded.url,
+                image_url = excluded.image_url,
+                review_count = excluded.review_count,
+                rating = excluded.rating,
+                last_seen = excluded.last_seen
+        """, rows)
+        conn.executemany(
+            "INSERT INTO price_history (product_id, price, recorded_at) VALUES (?, ?, ?)",
+            [(row[0], row[3], now) for row in rows]
+        )
+
+    print(f"💾 카탈로그 저장: {len(rows)}개 제품")
+
+def record_renders(conn, videos):
+    """생성된 쇼츠를 렌더링 이력에 일괄 기록"""
+    now = _now()
+    with conn:
+        conn.executemany(
+            "INSERT INTO renders (product_id, keyword, video_file, rendered_at) VALUES (?, ?, ?, ?)",
+            [(product_key(video['product']), video['keyword'], video['video_file'], now) for video in videos]
+        )
+
+def filter_recently_rendered(conn, products, window_days):
+    """
+    최근 window_days일 안에 쇼츠가 렌더링된 제품 제외
+
+    Returns:
+        (fresh, skipped) - skipped는 {'product', 'reason'} 목록
+    """
+    if window_days <= 0 or not products:
+        return list(products), []
+
+    since = (datetime.now() - timedelta(days=window_days)).isoformat(timespec='seconds')
+    keys = [product_key(product) for product in products]
+    placeholders = ", ".join("?" * len(keys))
+
+    last_rendered = dict(conn.execute(f"""
+        SELECT product_id, MAX(rendered_at) FROM renders
+        WHERE product_id IN ({placeholders}) AND rendered_at >= ?
+        GROUP BY product_id
+    """, keys + [since]).fetchall())
+
+    fresh = []
+    skipped = []
+    for key, product in zip(keys, products):
+        if key in last_rendered:
+            skipped.append({
+                'product': product,
+                'reason': f"최근 {window_days}일 내 렌더링됨 ({last_rendered[key]})"
+            })
+        else:
+            fresh.append(product)
+
+    return fresh, skipped
+
+def get_price_history(conn, product_id):
+    """제품의 가격 변동 이력 [(recorded_at, price), ...]"""
+    return conn.execute(
+        "SELECT recorded_at, price FROM price_history WHERE product_id = ? ORDER BY recorded_at",
+        (product_id,)
+    ).fetchall()
+
+def export_products_json(products, output_file='products.json'):
+    """
+    이번 실행 제품을 기존 products.json 형태로 내보내기
+
+    카탈로그 행은 productId 단위라 다른 키워드로 덮어써질 수 있으므로 메모리의 제품 목록 사용
+    """
+    exported = [{field: product.get(field) for field in EXPORT_FIELDS} for product in products]
+
+    with open(output_file, 'w', encoding='utf-8') as f:
+        json.dump(exported, f, ensure_ascii=False, separators=(',', ':'))
+    print(f"💾 제품 데이터 저장: {output_file}")
@@ -2,15 +2,44 @@
 import os
 import hmac
 import hashlib
+import heapq
+import json
 import requests
 import sys
 import traceback
 import time
 from datetime import datetime, timezone
 from urllib.parse import urlencode
+from env_config import get_env_number
 
 DOMAIN = "https://api-gateway.coupang.com"
 
+SEARCH_LIMIT = 10  # 검색 API 1회 요청 최대 결과 수 (키워드당 1회 요청)
+
+# 카테고리별 예상 수수료율 (%) - COMMISSION_RATES_FILE(JSON)로 덮어쓰기 가능
+DEFAULT_COMMISSION_RATE = 5.0
+COMMISSION_RATES = {
+    '여성패션': 6.8,
+    '남성패션': 6.8,
+    '패션의류': 6.8,
+    '뷰티': 5.3,
+    '식품': 5.3,
+    '헬스/건강식품': 5.3,
+    '출산/유아동': 4.5,
+    '생활용품': 4.5,
+    '주방용품': 4.5,
+    '홈인테리어': 4.5,
+    '반려동물용품': 4.5,
+    '스포츠/레저': 4.0,
+    '완구/취미': 4.0,
+    '문구/오피스': 4.0,
+    '자동차용품': 4.0,
+    '가전디지털': 2.0,
+    '도서/음반/DVD': 2.0,
+}
+
+_commission_rates = None  # load_commission_rates 캐시
+
 def generate_hmac_signature(method, path, query_string, access_key, secret_key):
     """HMAC 서명 생성"""
     now_utc = datetime.now(timezone.utc)
@@ -33,6 +62,35 @@ def generate_hmac_signature(method, path, query_string, access_key, secret_key):
     
     return authorization
 
+def load_commission_rates():
+    """카테고리 → 수수료율 테이블 로드 (프로세스당 1회)"""
+    global _commission_rates
+    if _commission_rates is None:
+        _commission_rates = dict(COMMISSION_RATES)
+        rates_file = os.environ.get('COMMISSION_RATES_FILE', '').strip()
+        if rates_file:
+            try:
+                with open(rates_file, encoding='utf-8') as f:
+                    overrides = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"⚠️ 수수료율 파일 로드 실패 ({rates_file}): {e}")
+                overrides = {}
+            
+            if not isinstance(overrides, dict):
+                print(f"⚠️ 수수료율 파일 형식 오류 ({rates_file}): 카테고리 → 수수료율 객체가 아닙니다")
+                overrides = {}
+            
+            for category, rate in overrides.items():
+                try:
+                    _commission_rates[category] = float(rate)
+                except (TypeError, ValueError):
+                    print(f"⚠️ 수수료율 무시 ({category}: {rate!r})")
+    return _commission_rates
+
+def get_commission_rate(category_name):
+    """categoryName으로 예상 수수료율 조회"""
+    return load_commission_rates().get(category_name, DEFAULT_COMMISSION_RATE)
+
 def search_products(keyword, limit, access_key, secret_key):
     """쿠팡 파트너스 제품 검색 API"""
     path = "/v2/providers/affiliate_open_api/apis/openapi/products/search"
@@ -92,11 +150,51 @@ def format_product(product):
         'categoryName': product.get('categoryName', ''),
     }
 
+def iter_search_results(keyword, access_key, secret_key, limit=SEARCH_LIMIT):
+    """
+    키워드 검색 결과를 제품 단위로 스트리밍 (제너레이터)
+    
+    검색 API는 페이지 파라미터가 없으므로 최대 크기 요청 1회로 후보를 받아옴
+    
+    Raises:
+        RuntimeError: 검색 실패 시 (API 오류 메시지 포함)
+    """
+    products, error = search_products(keyword, limit=limit, access_key=access_key, secret_key=secret_key)
+    
+    if error:
+        raise RuntimeError(error)
+    
+    for product in products or []:
+        yield format_product(product)
+
+def rank_products(candidates, top_k):
+    """
+    예상 수수료(가격 × 카테고리 수수료율) 기준 상위 top_k 제품 선택
+    
+    크기 top_k의 최소 힙만 유지하므로 후보 수와 무관하게 메모리 사용량 일정
+    """
+    heap = []
+    
+    for seq, product in enumerate(candidates):
+        rate = get_commission_rate(product['categoryName'])
+        commission = int(product['productPrice'] * rate / 100)
+        entry = (commission, -seq, {**product, 'commissionRate': rate, 'commission': commission})
+        
+        if len(heap) < top_k:
+            heapq.heappush(heap, entry)
+        elif entry[:2] > heap[0][:2]:
+            heapq.heapreplace(heap, entry)
+    
+    return [entry[2] for entry in sorted(heap, key=lambda e: e[:2], reverse=True)]
+
 def main():
     """메인 실행"""
     try:
+        # 1위가 최근 렌더링된 경우 파이프라인이 다음 순위를 쓸 수 있도록 후보 여러 개 기록
+        top_k = max(get_env_number('TOP_K_PER_KEYWORD', 5), 1)
+        
         print("=" * 70)
-        print("🎯 쿠팡 파트너스: TOP 1 고수수료 제품 찾기")
+        print(f"🎯 쿠팡 파트너스: TOP {top_k} 고수수료 제품 찾기")
         print("=" * 70)
         
         ACCESS_KEY = os.environ.get('COUPANG_ACCESS_KEY', '').strip()
@@ -109,11 +207,11 @@ def main():
             sys.exit(1)
         
         print("✅ API 키 로드 완료")
-        print("🔒 Rate Limit 안전 모드: 키워드당 1개만 검색, 15초 대기")
+        print(f"🔒 Rate Limit 안전 모드: 키워드당 1회 요청 (최대 {SEARCH_LIMIT}개 후보), 15초 대기")
         print()
         
         keywords = ['여성의류', '화장품세트', '건강식품']
-        print(f"🔍 검색 키워드: {', '.join(keywords)} (각 키워드당 TOP 1)")
+        print(f"🔍 검색 키워드: {', '.join(keywords)} (각 키워드당 TOP {top_k})")
         
         results = []
         
@@ -122,24 +220,27 @@ def main():
             print(f"📌 키워드: {keyword} ({idx}/{len(keywords)})")
             print("=" * 70)
             print()
-            print(f"🔍 '{keyword}' TOP 1 검색 중...")
-            
-            products, error = search_products(keyword, limit=1, access_key=ACCESS_KEY, secret_key=SECRET_KEY)
+            print(f"🔍 '{keyword}' TOP {top_k} 검색 중...")
             
-            if error:
-                print(f"   ❌ 검색 실패: {error}")
+            try:
+                ranked = rank_products(
+                    iter_search_results(keyword, access_key=ACCESS_KEY, secret_key=SECRET_KEY),
+                    top_k
+                )
+            except RuntimeError as e:
+                print(f"   ❌ 검색 실패: {e}")
                 print("⚠️ 검색 실패")
                 continue
             
-            if not isinstance(products, list) or len(products) == 0:
+            if not ranked:
                 print("   ⚠️ 제품 없음")
                 continue
             
-            product = products[0]
-            formatted = format_product(product)
-            results.append({'keyword': keyword, 'product': formatted})
+            results.append({'keyword': keyword, 'products': ranked})
             
-            print(f"✅ 검색 성공: {formatted['productName'][:50]}")
+            for rank, formatted in enumerate(ranked, 1):
+                print(f"✅ {rank}위: {formatted['productName'][:50]} "
+                      f"(예상 수수료 {formatted['commission']:,}원)")
             print()
             
             if idx < len(keywords):
@@ -151,22 +252,23 @@ def main():
             if results:
                 for idx, item in enumerate(results, 1):
                     keyword = item['keyword']
-                    product = item['product']
                     
                     f.write(f"=" * 70 + "\n")
                     f.write(f"📌 키워드: {keyword} ({idx}/{len(results)})\n")
                     f.write(f"=" * 70 + "\n\n")
                     
-                    f.write(f"1. {product['productName']}\n")
-                    f.write(f"   💰 가격: {product['productPrice']:,}원\n")
-                    f.write(f"   📂 카테고리: {product['categoryName']}\n")
-                    f.write(f"   📊 예상 수수료율: 5.0%\n")
-                    f.write(f"   💵 예상 수수료: {int(product['productPrice'] * 0.05):,}원\n")
-                    if product['isRocket']:
-                        f.write(f"   🚀 로켓배송\n")
-                    f.write(f"   🖼️ 이미지: {product['productImage']}\n")  # ⭐ 추가    
-                    f.write(f"   🔗 파트너스 링크: {product['productUrl']}...\n")
-                    f.write("\n")
+                    for rank, product in enumerate(item['products'], 1):
+                        f.write(f"{rank}. {product['productName']}\n")
+                        f.write(f"   🆔 제품 ID: {product['productId']}\n")
+                        f.write(f"   💰 가격: {product['productPrice']:,}원\n")
+                        f.write(f"   📂 카테고리: {product['categoryName']}\n")
+                        f.write(f"   📊 예상 수수료율: {product['commissionRate']:.1f}%\n")
+                        f.write(f"   💵 예상 수수료: {product['commission']:,}원\n")
+                        if product['isRocket']:
+                            f.write(f"   🚀 로켓배송\n")
+                        f.write(f"   🖼️ 이미지: {product['productImage']}\n")  # ⭐ 추가    
+                        f.write(f"   🔗 파트너스 링크: {product['productUrl']}...\n")
+                        f.write("\n")
             else:
                 f.write("=" * 70 + "\n")
                 f.write("⚠️ 예상 고수수료 제품을 찾지 못했습니다.\n")
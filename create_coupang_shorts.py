@@ -5,6 +5,12 @@ from PIL import Image, ImageDraw, ImageFont
 import requests
 import os
 import tempfile
+from captions import write_captions, mux_soft_subtitles
+
+# mp4에 소프트 자막 스트림 포함 여부 (SRT/WebVTT 파일은 항상 생성)
+SOFT_SUBTITLES = os.environ.get('SOFT_SUBTITLES', '').strip() in ('1', 'true', 'yes')
+
+_fonts = None  # 폰트 캐시 (load_fonts)
 
 def download_product_image(image_url):
     """제품 이미지 다운로드"""
@@ -34,17 +40,152 @@ def download_product_image(image_url):
         print(f"   ⚠️ 이미지 다운로드 오류: {e}")
         return None
 
-def create_shorts(product):
+def load_fonts():
+    """나눔고딕 폰트 로드 (없으면 기본 폰트)"""
+    global _fonts
+    if _fonts is None:
+        try:
+            _fonts = (
+                ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothicBold.ttf", 70),
+                ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothic.ttf", 50),
+                ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothic.ttf", 40),
+            )
+        except:
+            default = ImageFont.load_default()
+            _fonts = (default, default, default)
+    return _fonts
+
+def compose_frame(product, product_img_path=None):
+    """
+    쇼츠 프레임 이미지 합성 (1080x1920, 제품 이미지 + 텍스트)
+    """
+    name = product.get('name', '쿠팡 추천 제품')
+    price = product.get('price', 0)
+    rocket = product.get('rocket', False)
+    
+    # 1. 배경 이미지 생성 (1080x1920 세로)
+    img = Image.new('RGB', (1080, 1920), color=(255, 255, 255))
+    draw = ImageDraw.Draw(img)
+    
+    # 폰트 로드 (프로세스당 1회)
+    font_large, font_medium, font_small = load_fonts()
+    
+    # 2. 제품 이미지 삽입 (상단)
+    y_position = 150
+    
+    if product_img_path and os.path.exists(product_img_path):
+        try:
+            with Image.open(product_img_path) as source_img:
+                # JPEG는 디코딩 단계에서 축소 (800x800 이상 유지)
+                source_img.draft('RGB', (800, 800))
+                
+                # 정사각형으로 크롭 (중앙)
+                width, height = source_img.size
+                min_dim = min(width, height)
+                left = (width - min_dim) // 2
+                top = (height - min_dim) // 2
+                
+                # 리사이즈 (800x800)
+                product_img = source_img.convert('RGB').resize(
+                    (800, 800), Image.Resampling.LANCZOS,
+                    box=(left, top, left + min_dim, top + min_dim)
+                )
+            
+            # 배경에 붙여넣기 (중앙 정렬)
+            img.paste(product_img, (140, y_position))
+            
+            y_position += 870  # 이미지 아래로 이동
+            
+            print(f"   ✅ 제품 이미지 추가 완료")
+        except Exception as e:
+            print(f"   ⚠️ 이미지 처리 실패: {e}")
+            y_position = 400
+    else:
+        print(f"   ⚠️ 제품 이미지 없음 (텍스트만 사용)")
+        y_position = 400
+    
+    # 3. 제목 (여러 줄 처리)
+    max_width = 950
+    
+    words = name.split()
+    lines = []
+    current_line = ""
+    
+    for word in words:
+        test_line = current_line + word + " "
+        bbox = draw.textbbox((0, 0), test_line, font=font_medium)
+        if bbox[2] - bbox[0] <= max_width:
+            current_line = test_line
+        else:
+            if current_line:
+                lines.append(current_line.strip())
+            current_line = word + " "
+    
+    if current_line:
+        lines.append(current_line.strip())
+    
+    # 최대 2줄만
+    for line in lines[:2]:
+        bbox = draw.textbbox((0, 0), line, font=font_medium)
+        text_width = bbox[2] - bbox[0]
+        x = (1080 - text_width) // 2
+        draw.text((x, y_position), line, fill=(50, 50, 50), font=font_medium)
+        y_position += 70
+    
+    # 4. 가격 (빨간색, 크게)
+    y_position += 30
+    price_text = f"₩{price:,}원"
+    bbox = draw.textbbox((0, 0), price_text, font=font_large)
+    text_width = bbox[2] - bbox[0]
+    draw.text(((1080 - text_width) // 2, y_position), price_text, fill=(255, 50, 50), font=font_large)
+    
+    # 5. 로켓배송
+    y_position += 100
+    if rocket:
+        rocket_text = "🚀 로켓배송 가능"
+        bbox = draw.textbbox((0, 0), rocket_text, font=font_small)
+        text_width = bbox[2] - bbox[0]
+        draw.text(((1080 - text_width) // 2, y_position), rocket_text, fill=(0, 100, 255), font=font_small)
+    
+    # 6. 하단 정보
+    link_text = "🔗 링크는 댓글 확인!"
+    bbox = draw.textbbox((0, 0), link_text, font=font_small)
+    text_width = bbox[2] - bbox[0]
+    draw.text(((1080 - text_width) // 2, 1800), link_text, fill=(100, 100, 100), font=font_small)
+    
+    return img
+
+def safe_filename(keyword):
+    """키워드를 파일명에 쓸 수 있는 문자열로 변환"""
+    safe_keyword = "".join(c for c in keyword if c.isalnum() or c in (' ', '_')).strip()
+    return safe_keyword.replace(' ', '_')
+
+def build_script(product):
+    """TTS 대본 생성"""
+    name = product.get('name', '쿠팡 추천 제품')
+    price = product.get('price', 0)
+    script = f"{name}. 가격은 {price:,}원입니다."
+    if product.get('rocket', False):
+        script += " 로켓배송 가능합니다."
+    return script
+
+def create_shorts(product, threads=None):
     """
     쿠팡 제품 데이터로 YouTube 쇼츠 생성 (제품 이미지 포함)
+    
+    threads: x264 인코딩 스레드 수 (None이면 ffmpeg 기본값)
+    
+    오디오/비디오 클립과 임시 파일은 성공 여부와 관계없이 즉시 정리
     """
+    audio_path = None
+    img_path = None
+    product_img_path = None
+    clips = []
+    
     try:
         keyword = product.get('keyword', 'product')
         name = product.get('name', '쿠팡 추천 제품')
         price = product.get('price', 0)
-        url = product.get('url', '')
-        category = product.get('category', '')
-        rocket = product.get('rocket', False)
         image_url = product.get('image_url', '')
         
         print(f"🎬 '{keyword}' 쇼츠 생성 중...")
@@ -52,146 +193,68 @@ def create_shorts(product):
         print(f"   가격: ₩{price:,}")
         
         # 1. 음성 생성 (TTS)
-        script = f"{name}. 가격은 {price:,}원입니다."
-        if rocket:
-            script += " 로켓배송 가능합니다."
+        script = build_script(product)
         
         print(f"   🎤 음성 생성 중...")
         tts = gTTS(text=script, lang='ko')
         audio_file = tempfile.NamedTemporaryFile(delete=False, suffix='.mp3')
-        tts.save(audio_file.name)
+        audio_file.close()
+        audio_path = audio_file.name
+        tts.save(audio_path)
         
-        audio_clip = AudioFileClip(audio_file.name)
+        audio_clip = AudioFileClip(audio_path)
+        clips.append(audio_clip)
         duration = audio_clip.duration
         print(f"   ✅ 음성 생성 완료 ({duration:.1f}초)")
         
         # 2. 제품 이미지 다운로드
         product_img_path = download_product_image(image_url)
         
-        # 3. 배경 이미지 생성 (1080x1920 세로)
+        # 3. 프레임 합성 (1080x1920 세로)
         print(f"   🎨 배경 이미지 생성 중...")
-        img = Image.new('RGB', (1080, 1920), color=(255, 255, 255))
-        draw = ImageDraw.Draw(img)
-        
-        # 폰트 로드
-        try:
-            font_large = ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothicBold.ttf", 70)
-            font_medium = ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothic.ttf", 50)
-            font_small = ImageFont.truetype("/usr/share/fonts/truetype/nanum/NanumGothic.ttf", 40)
-        except:
-            font_large = ImageFont.load_default()
-            font_medium = ImageFont.load_default()
-            font_small = ImageFont.load_default()
-        
-        # 4. 제품 이미지 삽입 (상단)
-        y_position = 150
-        
-        if product_img_path and os.path.exists(product_img_path):
-            try:
-                product_img = Image.open(product_img_path)
-                
-                # 정사각형으로 크롭 (중앙)
-                width, height = product_img.size
-                min_dim = min(width, height)
-                left = (width - min_dim) // 2
-                top = (height - min_dim) // 2
-                product_img = product_img.crop((left, top, left + min_dim, top + min_dim))
-                
-                # 리사이즈 (800x800)
-                product_img = product_img.resize((800, 800), Image.Resampling.LANCZOS)
-                
-                # 배경에 붙여넣기 (중앙 정렬)
-                img.paste(product_img, (140, y_position))
-                
-                y_position += 870  # 이미지 아래로 이동
-                
-                print(f"   ✅ 제품 이미지 추가 완료")
-            except Exception as e:
-                print(f"   ⚠️ 이미지 처리 실패: {e}")
-                y_position = 400
-        else:
-            print(f"   ⚠️ 제품 이미지 없음 (텍스트만 사용)")
-            y_position = 400
-        
-        # 5. 제목 (여러 줄 처리)
-        max_width = 950
-        
-        words = name.split()
-        lines = []
-        current_line = ""
-        
-        for word in words:
-            test_line = current_line + word + " "
-            bbox = draw.textbbox((0, 0), test_line, font=font_medium)
-            if bbox[2] - bbox[0] <= max_width:
-                current_line = test_line
-            else:
-                if current_line:
-                    lines.append(current_line.strip())
-                current_line = word + " "
-        
-        if current_line:
-            lines.append(current_line.strip())
-        
-        # 최대 2줄만
-        for line in lines[:2]:
-            bbox = draw.textbbox((0, 0), line, font=font_medium)
-            text_width = bbox[2] - bbox[0]
-            x = (1080 - text_width) // 2
-            draw.text((x, y_position), line, fill=(50, 50, 50), font=font_medium)
-            y_position += 70
-        
-        # 6. 가격 (빨간색, 크게)
-        y_position += 30
-        price_text = f"₩{price:,}원"
-        bbox = draw.textbbox((0, 0), price_text, font=font_large)
-        text_width = bbox[2] - bbox[0]
-        draw.text(((1080 - text_width) // 2, y_position), price_text, fill=(255, 50, 50), font=font_large)
-        
-        # 7. 로켓배송
-        y_position += 100
-        if rocket:
-            rocket_text = "🚀 로켓배송 가능"
-            bbox = draw.textbbox((0, 0), rocket_text, font=font_small)
-            text_width = bbox[2] - bbox[0]
-            draw.text(((1080 - text_width) // 2, y_position), rocket_text, fill=(0, 100, 255), font=font_small)
-        
-        # 8. 하단 정보
-        link_text = "🔗 링크는 댓글 확인!"
-        bbox = draw.textbbox((0, 0), link_text, font=font_small)
-        text_width = bbox[2] - bbox[0]
-        draw.text(((1080 - text_width) // 2, 1800), link_text, fill=(100, 100, 100), font=font_small)
+        img = compose_frame(product, product_img_path)
         
-        # 9. 이미지 저장
+        # 4. 이미지 저장 (저장 후 캔버스 즉시 해제)
         img_file = tempfile.NamedTemporaryFile(delete=False, suffix='.png')
-        img.save(img_file.name)
+        img_file.close()
+        img_path = img_file.name
+        img.save(img_path)
+        img.close()
+        del img
         
-        # 10. 비디오 생성
+        # 5. 비디오 생성
         print(f"   🎬 비디오 생성 중...")
-        img_clip = ImageClip(img_file.name).set_duration(duration)
+        img_clip = ImageClip(img_path).set_duration(duration)
+        clips.append(img_clip)
         video = img_clip.set_audio(audio_clip)
+        clips.append(video)
         
         # 파일명 생성
-        safe_keyword = "".join(c for c in keyword if c.isalnum() or c in (' ', '_')).strip()
-        safe_keyword = safe_keyword.replace(' ', '_')
+        safe_keyword = safe_filename(keyword)
         video_file = f"shorts_{safe_keyword}.mp4"
         
-        # 비디오 저장
+        # 비디오 저장 (병렬 렌더링 시 임시 오디오 파일명 충돌 방지)
         video.write_videofile(
             video_file,
             fps=1,
             codec='libx264',
             audio_codec='aac',
-            temp_audiofile='temp-audio.m4a',
+            temp_audiofile=f"temp-audio-{safe_keyword}.m4a",
             remove_temp=True,
+            threads=threads,
             logger=None
         )
         
-        # 임시 파일 정리
-        os.unlink(audio_file.name)
-        os.unlink(img_file.name)
-        if product_img_path and os.path.exists(product_img_path):
-            os.unlink(product_img_path)
+        # 6. 자막 생성 (음성 길이 기반 타이밍, 추가 프레임 렌더링 없음)
+        # 자막 실패는 경고만 출력 (완성된 mp4는 그대로 사용)
+        try:
+            captions = write_captions(script, duration, video_file)
+            if captions:
+                print(f"   💬 자막 생성 완료: {', '.join(captions)}")
+                if SOFT_SUBTITLES and mux_soft_subtitles(video_file, captions[0]):
+                    print(f"   💬 소프트 자막 스트림 추가 완료")
+        except Exception as e:
+            print(f"   ⚠️ 자막 생성 실패: {e}")
         
         print(f"✅ 쇼츠 생성 완료: {video_file}")
         
@@ -202,3 +265,16 @@ def create_shorts(product):
         import traceback
         traceback.print_exc()
         return None
+    
+    finally:
+        # 클립 닫기 (ffmpeg 리더 프로세스 및 프레임 버퍼 해제)
+        for clip in reversed(clips):
+            try:
+                clip.close()
+            except Exception:
+                pass
+        
+        # 임시 파일 정리
+        for path in (audio_path, img_path, product_img_path):
+            if path and os.path.exists(path):
+                os.unlink(path)
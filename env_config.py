@@ -0,0 +1,13 @@
+# env_config.py - 환경변수 설정 읽기 (검색/쇼츠 생성 공통)
+import os
+
+def get_env_number(name, default, cast=int):
+    """숫자 환경변수 읽기 (값이 없거나 올바르지 않으면 경고 후 기본값)"""
+    value = os.environ.get(name, '').strip()
+    if not value:
+        return default
+    try:
+        return cast(value)
+    except ValueError:
+        print(f"⚠️ {name} 값이 올바르지 않습니다: {value} (기본값 {default} 사용)")
+        return default
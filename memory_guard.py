@@ -0,0 +1,158 @@
+# memory_guard.py - 렌더링 메모리 측정 (제품별 최대 RSS) 및 동시 작업 제한
+import os
+import threading
+
+DEFAULT_JOB_RESERVE_MB = 300.0  # 측정값이 없을 때 작업 1개 예상 메모리
+
+def _read_statm_mb(pid):
+    """/proc/<pid>/statm의 RSS (MB), 읽을 수 없으면 None"""
+    try:
+        with open(f'/proc/{pid}/statm') as f:
+            resident_pages = int(f.read().split()[1])
+        return resident_pages * os.sysconf('SC_PAGE_SIZE') / 1024 / 1024
+    except (OSError, ValueError, IndexError):
+        return None
+
+def _child_pids(pid):
+    """pid의 모든 하위 프로세스 (ffmpeg 인코더/디코더 포함)"""
+    try:
+        tids = os.listdir(f'/proc/{pid}/task')
+    except OSError:
+        return []
+
+    # 스캔 중 종료된 스레드만 건너뜀 (나머지 하위 프로세스는 유지)
+    children = []
+    for tid in tids:
+        try:
+            with open(f'/proc/{pid}/task/{tid}/children') as f:
+                children.extend(int(child) for child in f.read().split())
+        except (OSError, ValueError):
+            continue
+
+    descendants = list(children)
+    for child in children:
+        descendants.extend(_child_pids(child))
+    return descendants
+
+def read_rss_mb():
+    """현재 프로세스 + 하위 프로세스(ffmpeg 등) RSS 합계 (MB)"""
+    own_mb = _read_statm_mb('self')
+    if own_mb is not None:
+        pid = os.getpid()
+        return own_mb + sum(_read_statm_mb(child) or 0.0 for child in _child_pids(pid))
+
+    # /proc 없는 환경: 프로세스 최대 RSS로 대체 (하위 프로세스 미포함)
+    try:
+        import resource
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    except ImportError:
+        return 0.0
+
+class PeakRssSampler:
+    """
+    with 블록 실행 중 프로세스 + 하위 프로세스 RSS 최대값 측정 (백그라운드 샘플링)
+
+    동시 렌더링 중에는 같은 프로세스의 다른 작업 메모리도 포함됨
+    """
+
+    def __init__(self, interval=0.05):
+        self.interval = interval
+        self.start_mb = 0.0
+        self.peak_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = None
+
+    def _sample(self):
+        while not self._stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, read_rss_mb())
+
+    def __enter__(self):
+        self.start_mb = self.peak_mb = read_rss_mb()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info):
+        self._stop.set()
+        self._thread.join()
+        self.peak_mb = max(self.peak_mb, read_rss_mb())
+        return False
+
+    @property
+    def delta_mb(self):
+        """작업 시작 대비 최대 증가량 (MB)"""
+        return max(self.peak_mb - self.start_mb, 0.0)
+
+class MemoryGovernor:
+    """
+    동시 렌더링 작업 수 제한
+
+    max_workers개까지 동시에 실행하되, 확보된 메모리
+    (작업이 없을 때 측정한 기준 RSS + 실행 중 작업 수 × 작업 1개 예상 메모리)에
+    작업 1개를 더한 값이 limit_mb를 넘으면 실행 중인 작업이 끝날 때까지 대기시킴
+    (실행 중인 작업이 없으면 항상 1개는 허용)
+
+    작업 1개 예상 메모리는 단독으로 실행된 작업의 측정값으로만 갱신
+    (동시 실행 중 측정값에는 다른 작업의 메모리가 섞여 있음)
+    """
+
+    def __init__(self, limit_mb=0, max_workers=1):
+        self.limit_mb = limit_mb
+        self.max_workers = max(max_workers, 1)
+        self.job_reserve_mb = DEFAULT_JOB_RESERVE_MB
+        self.baseline_mb = 0.0
+        self.in_flight = 0
+        self._measured = False
+        self._active_jobs = []
+        self._condition = threading.Condition()
+
+    def _committed_mb(self):
+        return self.baseline_mb + self.in_flight * self.job_reserve_mb
+
+    def _has_room(self):
+        if self.in_flight >= self.max_workers:
+            return False
+        if self.in_flight == 0 or not self.limit_mb:
+            return True
+        return self._committed_mb() + self.job_reserve_mb <= self.limit_mb
+
+    def acquire(self):
+        """
+        작업 슬롯 확보 (메모리 여유가 생길 때까지 대기)
+
+        Returns:
+            release()에 넘길 작업 정보
+        """
+        with self._condition:
+            throttled = False
+            while not self._has_room():
+                if not throttled and self.in_flight < self.max_workers:
+                    print(f"   🧠 메모리 한도 대기 (확보 {self._committed_mb():.0f}MB "
+                          f"+ 예상 {self.job_reserve_mb:.0f}MB / 한도 {self.limit_mb:.0f}MB)")
+                    throttled = True
+                self._condition.wait(timeout=1.0)
+
+            # 작업이 없을 때의 RSS를 기준값으로 사용
+            if self.in_flight == 0:
+                self.baseline_mb = read_rss_mb()
+
+            job = {'alone': not self._active_jobs}
+            for active_job in self._active_jobs:
+                active_job['alone'] = False
+            self._active_jobs.append(job)
+            self.in_flight += 1
+            return job
+
+    def release(self, job, job_delta_mb=None):
+        """작업 슬롯 반환 (단독 실행 작업의 측정 메모리로 예상치 갱신)"""
+        with self._condition:
+            self._active_jobs.remove(job)
+            self.in_flight -= 1
+            if job_delta_mb and job['alone']:
+                # 첫 측정값이 기본값을 대체하고, 이후에는 최대값 유지
+                if self._measured:
+                    self.job_reserve_mb = max(self.job_reserve_mb, job_delta_mb)
+                else:
+                    self.job_reserve_mb = job_delta_mb
+                    self._measured = True
+            self._condition.notify_all()
@@ -3,9 +3,40 @@
 # pipeline_manager.py - 쿠팡 검색 → 쇼츠 생성 통합 (API 키 불필요)
 import os
 import re
-import json
+import gc
+import math
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from create_coupang_shorts import create_shorts
+from PIL import Image
+from catalog_store import (
+    open_catalog, upsert_products, record_renders, filter_recently_rendered,
+    export_products_json, product_key
+)
+from captions import caption_paths
+from env_config import get_env_number
+from memory_guard import MemoryGovernor, PeakRssSampler
+from create_coupang_shorts import (
+    create_shorts, build_script, compose_frame, download_product_image, safe_filename
+)
+
+# 렌더링 시간 예측 (대본 길이 기반)
+RENDER_BASE_SECONDS = 8.0       # TTS 요청 + 이미지 다운로드 + 인코더 시작
+RENDER_SECONDS_PER_CHAR = 0.12  # 대본 글자당 음성 길이/인코딩 비용
+
+# 미리보기 모드 (PREVIEW_MODE=1: TTS/인코딩 없이 프레임만 합성)
+PREVIEW_DIR = 'preview'
+PREVIEW_THUMB_SIZE = (216, 384)  # 1080x1920의 1/5
+PREVIEW_COLUMNS = 10
+PREVIEW_SHEET_ROWS = 40  # 컨택트 시트 1장 최대 행 수 (JPEG 최대 65535px 이내)
+PREVIEW_DOWNLOAD_WORKERS = 16
+
+# 렌더링 동시 작업 수 / 메모리 한도 (MB, 0이면 제한 없음)
+RENDER_WORKERS = max(get_env_number('RENDER_WORKERS', 1), 1)
+MEMORY_LIMIT_MB = get_env_number('MEMORY_LIMIT_MB', 0.0, float)
+
+# 최근 렌더링된 제품 재생성 방지 기간 (일, 0이면 비활성화)
+RERENDER_WINDOW_DAYS = get_env_number('RERENDER_WINDOW_DAYS', 7)
 
 def parse_result_txt(result_file='result.txt'):
     """result.txt 파싱하여 제품 데이터 추출"""
@@ -43,50 +74,14 @@ def parse_result_txt(result_file='result.txt'):
                 print(f"⚠️ {keyword}: 검색 실패")
                 continue
             
-            name_match = re.search(r'1\.\s+(.+?)(?:🚀)?\s*\n', section)
-            if not name_match:
-                continue
-            
-            name = name_match.group(1).strip()
-            
-            price_match = re.search(r'💰 가격:\s+([\d,]+)원', section)
-            price = int(price_match.group(1).replace(',', '')) if price_match else 0
-            
-            category_match = re.search(r'📂 카테고리:\s+(.+)', section)
-            category = category_match.group(1).strip() if category_match else ''
-            
-            rate_match = re.search(r'📊 예상 수수료율:\s+([\d.]+)%', section)
-            rate = float(rate_match.group(1)) if rate_match else 5.0
-            
-            commission_match = re.search(r'💵 예상 수수료:\s+([\d,]+)원', section)
-            commission = int(commission_match.group(1).replace(',', '')) if commission_match else 0
-            
-            # 파트너스 링크 추출
-            url_match = re.search(r'🔗 파트너스 링크:\s+(.+?)\.\.\.', section)
-            url = url_match.group(1).strip() if url_match else ''
-            
-            # ⭐ 이미지 URL 추출
-            image_match = re.search(r'🖼️ 이미지:\s+(.+)', section)
-            image_url = image_match.group(1).strip() if image_match else ''
-            
-            rocket = '🚀' in section
+            # 순위별 후보 제품 (1., 2., ... 항목)
+            entries = re.split(r'\n(?=\d+\.\s)', section)[1:]
             
-            product = {
-                'keyword': keyword,
-                'name': name,
-                'price': price,
-                'category': category,
-                'rate': rate,
-                'commission': commission,
-                'rocket': rocket,
-                'url': url,
-                'image_url': image_url,  # ⭐ 파싱한 값 사용
-                'review_count': 0,
-                'rating': 4.5
-            }
-            
-            products.append(product)
-            print(f"✅ {keyword}: {name[:40]}... (₩{price:,})")
+            for entry in entries:
+                product = parse_product_entry(keyword, entry)
+                if product:
+                    products.append(product)
+                    print(f"✅ {keyword} {product['rank']}위: {product['name'][:40]}... (₩{product['price']:,})")
         
         except Exception as e:
             print(f"⚠️ 섹션 파싱 중 오류: {e}")
@@ -104,8 +99,81 @@ def parse_result_txt(result_file='result.txt'):
     
     return products
 
+def parse_product_entry(keyword, entry):
+    """result.txt의 순위 항목 1개 파싱 (이름이 없으면 None)"""
+    name_match = re.match(r'(\d+)\.\s+(.+?)(?:🚀)?\s*\n', entry + '\n')
+    if not name_match:
+        return None
+    
+    rank = int(name_match.group(1))
+    name = name_match.group(2).strip()
+    
+    product_id_match = re.search(r'🆔 제품 ID:\s+(\S+)', entry)
+    product_id = product_id_match.group(1) if product_id_match else ''
+    
+    price_match = re.search(r'💰 가격:\s+([\d,]+)원', entry)
+    price = int(price_match.group(1).replace(',', '')) if price_match else 0
+    
+    category_match = re.search(r'📂 카테고리:\s+(.+)', entry)
+    category = category_match.group(1).strip() if category_match else ''
+    
+    rate_match = re.search(r'📊 예상 수수료율:\s+([\d.]+)%', entry)
+    rate = float(rate_match.group(1)) if rate_match else 5.0
+    
+    commission_match = re.search(r'💵 예상 수수료:\s+([\d,]+)원', entry)
+    commission = int(commission_match.group(1).replace(',', '')) if commission_match else 0
+    
+    # 파트너스 링크 추출
+    url_match = re.search(r'🔗 파트너스 링크:\s+(.+?)\.\.\.', entry)
+    url = url_match.group(1).strip() if url_match else ''
+    
+    # ⭐ 이미지 URL 추출
+    image_match = re.search(r'🖼️ 이미지:\s+(.+)', entry)
+    image_url = image_match.group(1).strip() if image_match else ''
+    
+    rocket = '🚀' in entry
+    
+    return {
+        'product_id': product_id,
+        'keyword': keyword,
+        'rank': rank,
+        'name': name,
+        'price': price,
+        'category': category,
+        'rate': rate,
+        'commission': commission,
+        'rocket': rocket,
+        'url': url,
+        'image_url': image_url,  # ⭐ 파싱한 값 사용
+        'review_count': 0,
+        'rating': 4.5
+    }
+
+def select_keyword_products(products):
+    """
+    키워드별로 남은 후보 중 최상위 순위 1개 선택 (키워드당 쇼츠 1개)
+    
+    1위가 최근 렌더링되어 제외됐다면 다음 순위 후보가 선택되며,
+    같은 제품이 여러 키워드에 나오면 앞선 키워드에만 배정
+    """
+    candidates = {}
+    for product in products:
+        candidates.setdefault(product['keyword'], []).append(product)
+    
+    selected = []
+    used_keys = set()
+    for keyword_candidates in candidates.values():
+        for product in sorted(keyword_candidates, key=lambda p: p.get('rank', 1)):
+            key = product_key(product)
+            if key not in used_keys:
+                used_keys.add(key)
+                selected.append(product)
+                break
+    
+    return selected
+
 def get_dummy_products():
-    """더미 제품 데이터"""
+    """더미 제품 데이터 (dummy=True: 카탈로그에 저장하지 않음)"""
     return [
         {
             'keyword': '여성의류',
@@ -118,7 +186,8 @@ def get_dummy_products():
             'url': 'https://link.coupang.com/a/bXXXXX',
             'image_url': '',
             'review_count': 1234,
-            'rating': 4.8
+            'rating': 4.8,
+            'dummy': True
         },
         {
             'keyword': '화장품세트',
@@ -131,7 +200,8 @@ def get_dummy_products():
             'url': 'https://link.coupang.com/a/bYYYYY',
             'image_url': '',
             'review_count': 856,
-            'rating': 4.9
+            'rating': 4.9,
+            'dummy': True
         },
         {
             'keyword': '건강식품',
@@ -144,59 +214,250 @@ def get_dummy_products():
             'url': 'https://link.coupang.com/a/bZZZZZ',
             'image_url': '',
             'review_count': 423,
-            'rating': 4.5
+            'rating': 4.5,
+            'dummy': True
         }
     ]
 
-def save_products_json(products, output_file='products.json'):
-    """제품 데이터를 JSON으로 저장"""
-    with open(output_file, 'w', encoding='utf-8') as f:
-        json.dump(products, f, ensure_ascii=False, indent=2)
-    print(f"💾 제품 데이터 저장: {output_file}")
+def expected_commission(product):
+    """제품의 예상 수수료 (commission 필드 우선, 없으면 가격 × 수수료율)"""
+    commission = product.get('commission', 0)
+    if commission:
+        return commission
+    return int(product.get('price', 0) * product.get('rate', 0) / 100)
+
+def estimate_render_time(product):
+    """대본 길이로 렌더링 소요 시간(초) 추정"""
+    return RENDER_BASE_SECONDS + len(build_script(product)) * RENDER_SECONDS_PER_CHAR
+
+def get_render_deadline():
+    """RENDER_TIME_BUDGET(초) 환경변수로 렌더링 마감 시각 계산 (없으면 None)"""
+    budget = get_env_number('RENDER_TIME_BUDGET', None, float)
+    if budget is None:
+        return None
+    if not math.isfinite(budget):
+        print(f"⚠️ RENDER_TIME_BUDGET 값이 올바르지 않습니다: {budget} (시간 제한 없이 진행)")
+        return None
+    return time.monotonic() + budget
+
+def schedule_products(products, deadline=None, workers=1):
+    """
+    예상 수수료 순으로 렌더링 작업 정렬 후 마감 시각 안에 들어가는 작업 선택
+    
+    workers개 작업이 동시에 실행되므로 남은 시간 × workers만큼의 작업량을 예약
+    
+    Returns:
+        (scheduled, deferred) - deferred는 {'product', 'reason'} 목록
+    """
+    ordered = sorted(products, key=expected_commission, reverse=True)
+    
+    if deadline is None:
+        return ordered, []
+    
+    remaining = (deadline - time.monotonic()) * max(workers, 1)
+    scheduled = []
+    deferred = []
+    
+    # 고수수료 제품부터 남은 시간에 들어가는 작업을 채움
+    for product in ordered:
+        estimate = estimate_render_time(product)
+        if estimate <= remaining:
+            scheduled.append(product)
+            remaining -= estimate
+        else:
+            deferred.append({
+                'product': product,
+                'reason': f"시간 부족 (예상 {estimate:.0f}초, 남은 예산 {max(remaining, 0):.0f}초)"
+            })
+    
+    return scheduled, deferred
+
+def render_product(product, governor, job):
+    """
+    쇼츠 1개 렌더링 (작업 중 최대 RSS 측정 후 슬롯 반환)
+    
+    Returns:
+        (video_file, peak_rss_mb)
+    """
+    video_file = None
+    
+    with PeakRssSampler() as sampler:
+        try:
+            # 병렬 렌더링 시에만 x264 스레드를 1개로 제한 (순차 모드는 기본값)
+            threads = 1 if governor.max_workers > 1 else None
+            video_file = create_shorts(product, threads=threads)
+        except Exception as e:
+            print(f"❌ 오류 발생: {e}")
+            import traceback
+            traceback.print_exc()
+        finally:
+            # 클립 그래프의 순환 참조까지 즉시 회수
+            gc.collect()
+    
+    governor.release(job, sampler.delta_mb)
+    
+    return video_file, sampler.peak_mb
 
-def create_all_shorts(products):
-    """모든 제품에 대해 쇼츠 생성"""
+def create_all_shorts(products, deadline=None):
+    """
+    모든 제품에 대해 쇼츠 생성 (예상 수수료 높은 순)
+    
+    Returns:
+        (created_videos, deferred) - 마감 시각 때문에 보류된 제품 포함
+    """
     print("=" * 70)
     print("🎬 쇼츠 생성 시작")
     print("=" * 70)
     print()
     
-    created_videos = []
+    governor = MemoryGovernor(MEMORY_LIMIT_MB, RENDER_WORKERS)
+    scheduled, deferred = schedule_products(products, deadline, governor.max_workers)
     
-    for idx, product in enumerate(products, 1):
-        print(f"▶ [{idx}/{len(products)}] {product['keyword']} 쇼츠 생성 중...")
+    if deadline is not None:
+        print(f"⏱️ 남은 시간 {max(deadline - time.monotonic(), 0):.0f}초: "
+              f"{len(scheduled)}개 예약, {len(deferred)}개 보류")
         print()
+    
+    jobs = []
+    
+    with ThreadPoolExecutor(max_workers=governor.max_workers) as executor:
+        for idx, product in enumerate(scheduled, 1):
+            # 메모리 여유가 생길 때까지 대기 (동시 작업 수 제한)
+            job = governor.acquire()
+            
+            # 실제 렌더링이 예측보다 느려지면 남은 작업 보류
+            if deadline is not None:
+                remaining = deadline - time.monotonic()
+                estimate = estimate_render_time(product)
+                if estimate > remaining:
+                    governor.release(job)
+                    deferred.append({
+                        'product': product,
+                        'reason': f"마감 임박 (예상 {estimate:.0f}초, 남은 시간 {max(remaining, 0):.0f}초)"
+                    })
+                    print(f"⏭️ [{idx}/{len(scheduled)}] {product['keyword']} 보류: 마감 임박")
+                    print()
+                    continue
+            
+            print(f"▶ [{idx}/{len(scheduled)}] {product['keyword']} 쇼츠 생성 중... "
+                  f"(예상 수수료 ₩{expected_commission(product):,})")
+            print()
+            
+            jobs.append((product, executor.submit(render_product, product, governor, job)))
+    
+    created_videos = []
+    
+    for product, future in jobs:
+        video_file, peak_rss_mb = future.result()
+        
+        if video_file and os.path.exists(video_file):
+            file_size = os.path.getsize(video_file)
+            created_videos.append({
+                'keyword': product['keyword'],
+                'video_file': video_file,
+                'file_size': file_size,
+                'peak_rss_mb': peak_rss_mb,
+                'caption_files': [path for path in caption_paths(video_file) if os.path.exists(path)],
+                'product': product
+            })
+            print(f"✅ 생성 완료: {video_file} ({file_size/1024/1024:.1f} MB, 최대 RSS {peak_rss_mb:.0f}MB)")
+        else:
+            print(f"❌ 생성 실패: {product['keyword']}")
+    
+    print()
+    
+    print("=" * 70)
+    print(f"✅ 쇼츠 생성 완료: {len(created_videos)}/{len(products)}개")
+    if deferred:
+        print(f"⏭️ 보류: {len(deferred)}개")
+    print("=" * 70)
+    print()
+    
+    return created_videos, deferred
+
+def create_previews(products, output_dir=PREVIEW_DIR):
+    """
+    미리보기 모드: TTS와 비디오 인코딩 없이 프레임만 합성
+    
+    제품별 축소 썸네일과 배치 컨택트 시트(최대 PREVIEW_SHEET_ROWS행씩 분할)를 output_dir에 저장
+    
+    Returns:
+        (thumbnails, contact_sheets) - 썸네일 경로 목록, 컨택트 시트 경로 목록
+    """
+    print("=" * 70)
+    print("🖼️ 미리보기 생성 시작 (TTS/인코딩 생략)")
+    print("=" * 70)
+    print()
+    
+    os.makedirs(output_dir, exist_ok=True)
+    
+    # 이미지 다운로드는 네트워크 대기가 대부분이므로 병렬 처리
+    with ThreadPoolExecutor(max_workers=PREVIEW_DOWNLOAD_WORKERS) as executor:
+        image_paths = list(executor.map(
+            lambda product: download_product_image(product.get('image_url', '')),
+            products
+        ))
+    
+    thumb_width, thumb_height = PREVIEW_THUMB_SIZE
+    columns = min(PREVIEW_COLUMNS, len(products)) or 1
+    per_sheet = columns * PREVIEW_SHEET_ROWS
+    
+    thumbnails = []
+    contact_sheets = []
+    sheet = None
+    
+    for idx, (product, image_path) in enumerate(zip(products, image_paths)):
+        # 시트가 가득 차면 새 시트 시작 (contact_sheet_001.jpg, ...)
+        if idx % per_sheet == 0:
+            save_contact_sheet(sheet, contact_sheets, output_dir)
+            rows = (min(per_sheet, len(products) - idx) + columns - 1) // columns
+            sheet = Image.new('RGB', (columns * thumb_width, rows * thumb_height), color=(255, 255, 255))
         
         try:
-            video_file = create_shorts(product)
+            frame = compose_frame(product, image_path)
+            frame.thumbnail(PREVIEW_THUMB_SIZE)
+            
+            thumb_file = os.path.join(
+                output_dir, f"thumb_{idx + 1:03d}_{safe_filename(product['keyword'])}.jpg"
+            )
+            frame.save(thumb_file, quality=85)
+            thumbnails.append(thumb_file)
             
-            if video_file and os.path.exists(video_file):
-                file_size = os.path.getsize(video_file)
-                created_videos.append({
-                    'keyword': product['keyword'],
-                    'video_file': video_file,
-                    'file_size': file_size,
-                    'product': product
-                })
-                print(f"✅ 생성 완료: {video_file} ({file_size/1024/1024:.1f} MB)")
-            else:
-                print(f"❌ 생성 실패: {product['keyword']}")
+            cell = idx % per_sheet
+            sheet.paste(frame, ((cell % columns) * thumb_width, (cell // columns) * thumb_height))
+            print(f"✅ [{idx + 1}/{len(products)}] {thumb_file}")
         
         except Exception as e:
-            print(f"❌ 오류 발생: {e}")
-            import traceback
-            traceback.print_exc()
+            print(f"❌ 미리보기 실패: {product['keyword']} ({e})")
         
-        print()
+        finally:
+            if image_path and os.path.exists(image_path):
+                os.unlink(image_path)
+    
+    save_contact_sheet(sheet, contact_sheets, output_dir)
     
+    print()
     print("=" * 70)
-    print(f"✅ 쇼츠 생성 완료: {len(created_videos)}/{len(products)}개")
+    print(f"✅ 미리보기 완료: {len(thumbnails)}/{len(products)}개")
+    print(f"🗂️ 컨택트 시트: {', '.join(contact_sheets) or '없음'}")
     print("=" * 70)
     print()
     
-    return created_videos
+    return thumbnails, contact_sheets
 
-def generate_summary(products, videos):
+def save_contact_sheet(sheet, contact_sheets, output_dir):
+    """컨택트 시트 저장 후 경로를 contact_sheets에 추가 (sheet가 None이면 무시)"""
+    if sheet is None:
+        return
+    
+    contact_sheet = os.path.join(output_dir, f"contact_sheet_{len(contact_sheets) + 1:03d}.jpg")
+    try:
+        sheet.save(contact_sheet, quality=85)
+        contact_sheets.append(contact_sheet)
+    except Exception as e:
+        print(f"❌ 컨택트 시트 저장 실패: {contact_sheet} ({e})")
+
+def generate_summary(products, videos, deferred=None):
     """요약 리포트 생성"""
     print("=" * 70)
     print("📊 최종 요약")
@@ -207,13 +468,20 @@ def generate_summary(products, videos):
     print(f"🎬 생성된 쇼츠: {len(videos)}개")
     print()
     
+    deferred = deferred or []
+    if deferred:
+        print("⏭️ 보류된 제품 목록:")
+        for item in deferred:
+            print(f"  ⏭️ {item['product']['keyword']}: {item['reason']}")
+        print()
+    
     if videos:
         print("📹 생성된 쇼츠 목록:")
         total_size = 0
         for video in videos:
             size_mb = video['file_size'] / 1024 / 1024
             total_size += video['file_size']
-            print(f"  ✅ {video['video_file']} ({size_mb:.1f} MB)")
+            print(f"  ✅ {video['video_file']} ({size_mb:.1f} MB, 최대 RSS {video['peak_rss_mb']:.0f}MB)")
             print(f"     제품: {video['product']['name'][:40]}...")
             print(f"     가격: ₩{video['product']['price']:,}")
             print(f"     파트너스 링크: {video['product']['url'][:50]}...")
@@ -235,8 +503,19 @@ def generate_summary(products, videos):
             for video in videos:
                 f.write(f"  - {video['video_file']}\n")
                 f.write(f"    링크: {video['product']['url']}\n")
+                f.write(f"    최대 RSS: {video['peak_rss_mb']:.0f}MB\n")
+                if video['caption_files']:
+                    f.write(f"    자막: {', '.join(video['caption_files'])}\n")
         else:
             f.write(f"생성된 파일: 없음\n")
+        if deferred:
+            f.write(f"\n")
+            f.write(f"보류된 제품: {len(deferred)}개\n")
+            for item in deferred:
+                product = item['product']
+                f.write(f"  - {product['keyword']}: {product['name'][:40]}\n")
+                f.write(f"    예상 수수료: ₩{expected_commission(product):,}\n")
+                f.write(f"    사유: {item['reason']}\n")
     
     print("💾 요약 저장: summary.txt")
     print("=" * 70)
@@ -250,6 +529,9 @@ def main():
     print()
     
     try:
+        # 렌더링 마감 시각 (RENDER_TIME_BUDGET 설정 시)
+        deadline = get_render_deadline()
+        
         # 1. result.txt 파싱 (API 키 불필요)
         products = parse_result_txt('result.txt')
         
@@ -257,15 +539,45 @@ def main():
             print("❌ 제품 데이터를 가져올 수 없습니다.")
             return
         
-        # 2. JSON 저장
-        save_products_json(products)
+        # 미리보기 모드: 프레임만 합성 후 종료
+        if os.environ.get('PREVIEW_MODE', '').strip() in ('1', 'true', 'yes'):
+            thumbnails, _ = create_previews(products)
+            exit(0 if thumbnails else 1)
+        
+        # 2. products.json 내보내기 + 카탈로그 저장 (더미 데이터는 카탈로그 제외)
+        export_products_json(products)
+        is_dummy = any(product.get('dummy') for product in products)
+        catalog = None if is_dummy else open_catalog()
+        
+        if catalog is not None:
+            upsert_products(catalog, products)
+        else:
+            print("⚠️ 더미 데이터: 카탈로그 저장/재생성 방지 생략")
         print()
         
-        # 3. 쇼츠 생성
-        videos = create_all_shorts(products)
+        # 3. 최근 렌더링된 후보 제외 후 키워드별 최상위 후보 선택
+        if catalog is not None:
+            fresh, skipped = filter_recently_rendered(catalog, products, RERENDER_WINDOW_DAYS)
+        else:
+            fresh, skipped = products, []
+        selected = select_keyword_products(fresh)
+        
+        selected_keywords = {product['keyword'] for product in selected}
+        for keyword in dict.fromkeys(product['keyword'] for product in products):
+            if keyword not in selected_keywords:
+                print(f"⏭️ {keyword}: 남은 후보 없음 (최근 {RERENDER_WINDOW_DAYS}일 내 렌더링 또는 다른 키워드와 중복)")
+        if skipped:
+            print(f"⏭️ 최근 {RERENDER_WINDOW_DAYS}일 내 렌더링된 후보 {len(skipped)}개 제외")
+            print()
+        
+        # 4. 쇼츠 생성 (키워드당 1개)
+        videos, deferred = create_all_shorts(selected, deadline)
+        if catalog is not None:
+            record_renders(catalog, videos)
+            catalog.close()
         
-        # 4. 요약 생성
-        generate_summary(products, videos)
+        # 5. 요약 생성
+        generate_summary(products, videos, skipped + deferred)
         
         print()
         print("🎉 모든 작업 완료!")
@@ -274,6 +586,8 @@ def main():
         if videos:
             exit(0)
         else:
+            if not selected:
+                print(f"⚠️ 모든 후보가 최근 {RERENDER_WINDOW_DAYS}일 내 렌더링되었습니다.")
             print("⚠️ 생성된 쇼츠가 없습니다.")
             exit(1)
     